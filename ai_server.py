@@ -1,15 +1,44 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 import numpy as np
 import pickle
 import os
-from collections import defaultdict
+import atexit
+import struct
+import threading
+import queue
+import time
+from collections import OrderedDict
+from operator import itemgetter
 import random
 import logging
 from flask_cors import CORS
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; move classification falls back to plain Python
+    njit = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; Flask's default JSON provider is used instead
+    orjson = None
+
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": ["https://mesh-grid.vercel.app", "http://localhost:3000"]}})
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for faster request/response (de)serialization"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO,
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -25,37 +54,228 @@ MIN_EXPLORATION_RATE = 0.05
 # File to save Q-table
 Q_TABLE_FILE = 'q_table.pickle'
 
-# Initialize Q-table as a defaultdict to handle new states automatically
-Q_table = defaultdict(lambda: defaultdict(float))
+# Append-only log of Q-value updates since the last full save
+Q_WAL_FILE = 'q_table.wal'
+# Fixed-size WAL record: state hash, action bit, new Q-value
+WAL_RECORD = struct.Struct('<QBd')
+# Fold the WAL into a full Q-table save after this many updates
+WAL_COMPACT_EVERY = 1000
+# Seconds between background flushes of the WAL to disk
+WAL_FLUSH_INTERVAL = 5.0
+# Minimum seconds between background Q-table saves
+SAVE_MIN_INTERVAL = 5.0
+
+# One Q-table column per line on the 5x5 grid
+Q_ACTIONS = 40
+# Rows allocated up front; the table doubles when full
+Q_INITIAL_ROWS = 1024
+# Maximum number of states kept; the least recently used state is evicted beyond this
+Q_MAX_STATES = 1_000_000
+
+# Dense Q-table: state_row maps a state hash to its row, columns are line bits.
+# Q_seen marks the entries that have been written, since unwritten ones read as 0.0.
+# state_row is kept in least- to most-recently-used order for eviction.
+state_row = OrderedDict()
+Q_values = np.zeros((Q_INITIAL_ROWS, Q_ACTIONS), dtype=np.float32)
+Q_seen = np.zeros((Q_INITIAL_ROWS, Q_ACTIONS), dtype=bool)
+
+def ensure_q_rows(rows):
+    """Grow the Q-table arrays to hold at least this many rows"""
+    global Q_values, Q_seen
+    
+    capacity = len(Q_values)
+    while capacity < rows:
+        # Double the capacity, but never past Q_MAX_STATES
+        capacity = min(capacity * 2, max(Q_MAX_STATES, rows))
+    if capacity > len(Q_values):
+        extra = capacity - len(Q_values)
+        Q_values = np.concatenate([Q_values, np.zeros((extra, Q_ACTIONS), dtype=Q_values.dtype)])
+        Q_seen = np.concatenate([Q_seen, np.zeros((extra, Q_ACTIONS), dtype=bool)])
+
+def find_state_row(state):
+    """Return the Q-table row for a state, or None, marking it as recently used"""
+    row = state_row.get(state)
+    if row is not None:
+        state_row.move_to_end(state)
+    return row
+
+def get_state_row(state):
+    """Return the Q-table row for a state, allocating one if needed"""
+    row = find_state_row(state)
+    if row is None:
+        if len(state_row) >= Q_MAX_STATES:
+            # Evict the least recently used state and reuse its row
+            _, row = state_row.popitem(last=False)
+            Q_values[row] = 0.0
+            Q_seen[row] = False
+        else:
+            row = len(state_row)
+            ensure_q_rows(row + 1)
+        state_row[state] = row
+    return row
+
+def set_q_value(state, action, value):
+    """Write a single Q-value"""
+    row = get_state_row(state)
+    Q_values[row, action] = value
+    Q_seen[row, action] = True
 
 # Try to load existing Q-table if it exists
 if os.path.exists(Q_TABLE_FILE):
     try:
         with open(Q_TABLE_FILE, 'rb') as f:
-            Q_table_dict = pickle.load(f)
-            # Convert the saved dict to a defaultdict
-            for state, actions in Q_table_dict.items():
-                for action, value in actions.items():
-                    Q_table[state][action] = value
+            saved = pickle.load(f)
+        if 'state_row' in saved:
+            rows = len(saved['values'])
+            ensure_q_rows(rows)
+            state_row.update(saved['state_row'])
+            Q_values[:rows] = saved['values']
+            Q_seen[:rows] = saved['seen']
+        else:
+            # Older flat table keyed by (state, action)
+            for (state, action), value in saved.items():
+                set_q_value(state, action, value)
         logger.info("Q-table loaded successfully")
     except Exception as e:
+        state_row.clear()
+        Q_values[:] = 0.0
+        Q_seen[:] = False
         logger.error(f"Error loading Q-table: {e}")
 else:
     logger.info("Starting with a new Q-table")
 
+# Replay updates logged after the last full save
+if os.path.exists(Q_WAL_FILE):
+    try:
+        with open(Q_WAL_FILE, 'rb') as f:
+            wal_data = f.read()
+        # Ignore a partially written trailing record
+        wal_data = wal_data[:len(wal_data) - len(wal_data) % WAL_RECORD.size]
+        for state, action, value in WAL_RECORD.iter_unpack(wal_data):
+            set_q_value(state, action, value)
+        logger.info(f"Replayed {len(wal_data) // WAL_RECORD.size} Q-table updates from WAL")
+    except Exception as e:
+        logger.error(f"Error replaying Q-table WAL: {e}")
+
+# Guards the Q-table arrays, state_row and the WAL across request threads
+q_table_lock = threading.Lock()
+wal_file = open(Q_WAL_FILE, 'ab')
+# Flush buffered records on a clean shutdown; the flush timer thread is a daemon
+atexit.register(wal_file.close)
+updates_since_save = 0
+
 # Current exploration rate
 exploration_rate = EXPLORATION_RATE
 
+# Last (state, action, squares_bits) chosen per game session, for the follow-up Q-update.
+# Sessions that never send their update are dropped oldest-first beyond the cap.
+MAX_PENDING_SESSIONS = 4096
+last_state_action = OrderedDict()
+session_lock = threading.Lock()
+
+# Board geometry: a 5x5 grid of dots has 40 possible lines and 16 boxes
+GRID_SIZE = 5
+BOX_COUNT = GRID_SIZE - 1
+
+# Each legal line gets a fixed bit so the drawn lines fit in a single int
+LINE_BIT = {}
+for row in range(GRID_SIZE):
+    for col in range(GRID_SIZE - 1):
+        LINE_BIT[f"{row},{col}-{row},{col+1}"] = len(LINE_BIT)
+for row in range(GRID_SIZE - 1):
+    for col in range(GRID_SIZE):
+        LINE_BIT[f"{row},{col}-{row+1},{col}"] = len(LINE_BIT)
+
+# Line keys and bits in bit order, and the single-bit mask of each line
+ALL_LINE_KEYS = list(LINE_BIT)
+ALL_LINE_BITS = list(LINE_BIT.values())
+LINE_MASKS = [1 << bit for bit in ALL_LINE_BITS]
+
+# Bitmask of the four sides of each box, and the (at most two) boxes each line bit borders
+BOX_SIDE_BITS = {}
+LINES_TO_BOXES = [[] for _ in LINE_BIT]
+for row in range(BOX_COUNT):
+    for col in range(BOX_COUNT):
+        sides = [
+            f"{row},{col}-{row},{col+1}",      # top
+            f"{row},{col+1}-{row+1},{col+1}",  # right
+            f"{row+1},{col}-{row+1},{col+1}",  # bottom
+            f"{row},{col}-{row+1},{col}"       # left
+        ]
+        BOX_SIDE_BITS[(row, col)] = sum(1 << LINE_BIT[side] for side in sides)
+        for side in sides:
+            LINES_TO_BOXES[LINE_BIT[side]].append((row, col))
+
+# Packed side counts: each box's count lives in its own 4-bit nibble of one int.
+# Counts never exceed 4, so adding LINE_COUNT_STEP[bit] bumps the count of every
+# box that line borders without carrying into the next nibble.
+BOX_SHIFT = {box: 4 * i for i, box in enumerate(BOX_SIDE_BITS)}
+LINE_COUNT_STEP = [sum(1 << BOX_SHIFT[box] for box in boxes) for boxes in LINES_TO_BOXES]
+
+# Valid adjacent boxes (above, below, left, right) of each box
+BOX_NEIGHBOURS = {
+    (row, col): [(adj_row, adj_col)
+                 for adj_row, adj_col in ((row-1, col), (row+1, col), (row, col-1), (row, col+1))
+                 if 0 <= adj_row < BOX_COUNT and 0 <= adj_col < BOX_COUNT]
+    for row in range(BOX_COUNT) for col in range(BOX_COUNT)
+}
+
+def lines_to_bits(lines):
+    """Convert the JSON lines dict into an int bitmask of drawn lines (unknown keys are ignored)"""
+    lines_bits = 0
+    for key, value in lines.items():
+        bit = LINE_BIT.get(key)
+        if value and bit is not None:
+            lines_bits |= 1 << bit
+    return lines_bits
+
+# Each box gets a fixed bit (same order as BOX_SHIFT) for the squares bitmasks
+SQUARE_BIT = {f"{row},{col}": i for i, (row, col) in enumerate(BOX_SHIFT)}
+
+def squares_to_bits(squares, player_id):
+    """Convert the JSON squares dict into (filled, owned by player_id) bitmasks (unknown keys are ignored)"""
+    squares_bits = squares_owner = 0
+    for pos, owner in squares.items():
+        bit = SQUARE_BIT.get(pos)
+        if bit is None:
+            continue
+        square = 1 << bit
+        squares_bits |= square
+        if owner == player_id:
+            squares_owner |= square
+    return squares_bits, squares_owner
+
+# Zobrist keys for hashing board states. The seed is fixed so that state
+# hashes stay stable across restarts and match the persisted Q-table.
+ZOBRIST_SEED = 0x6D657368
+_zobrist_rng = random.Random(ZOBRIST_SEED)
+LINE_Z = [_zobrist_rng.getrandbits(64) for _ in LINE_BIT]
+# One key per square bit and owner: index 0 = owned by the AI, 1 = owned by the opponent
+SQUARE_Z = [(_zobrist_rng.getrandbits(64), _zobrist_rng.getrandbits(64)) for _ in SQUARE_BIT]
+
 # State representation functions
-def board_to_state(board):
-    """Convert board to a string representation for Q-learning"""
-    # Sort lines to ensure consistent state representation
-    lines_str = ','.join(sorted(key for key, value in board['lines'].items() if value))
-    squares_str = ','.join(f"{pos}:{owner}" for pos, owner in board['squares'].items())
-    return f"lines:{lines_str}|squares:{squares_str}"
+def board_to_state(lines_bits, squares_bits, squares_owner):
+    """Convert board to a 64-bit Zobrist hash for Q-learning"""
+    state_hash = 0
+    
+    # XOR in the key of every drawn line
+    bits = lines_bits
+    while bits:
+        lowest = bits & -bits
+        state_hash ^= LINE_Z[lowest.bit_length() - 1]
+        bits ^= lowest
+    
+    # XOR in each owned square, relative to the AI player
+    bits = squares_bits
+    while bits:
+        lowest = bits & -bits
+        state_hash ^= SQUARE_Z[lowest.bit_length() - 1][not squares_owner & lowest]
+        bits ^= lowest
+    
+    return state_hash
 
-def get_line_from_key(key):
-    """Convert line key back to coordinates"""
+def parse_line_key(key):
+    """Parse a line key into coordinates"""
     parts = key.split('-')
     start = parts[0].split(',')
     end = parts[1].split(',')
@@ -67,18 +287,28 @@ def get_line_from_key(key):
         'col2': int(end[1])
     }
 
+# Coordinates of every line, parsed once; treat these dicts as read-only
+LINE_COORDS = {key: parse_line_key(key) for key in ALL_LINE_KEYS}
+
+def get_line_from_key(key):
+    """Convert line key back to coordinates"""
+    return LINE_COORDS[key]
+
 # Reward calculation function
-def calculate_reward(prev_squares, current_squares, player_id):
+def calculate_reward(prev_squares_bits, squares_bits, squares_owner):
     """Calculate reward based on squares completed and strategic positioning"""
+    new_squares = squares_bits & ~prev_squares_bits
+    opponent_squares = squares_bits & ~squares_owner
+    
     # Count new squares owned by AI
-    ai_new_squares = len([sq for sq in current_squares.items() if sq[0] not in prev_squares and sq[1] == player_id])
+    ai_new_squares = (new_squares & squares_owner).bit_count()
     
     # Count new squares owned by opponent
-    opponent_new_squares = len([sq for sq in current_squares.items() if sq[0] not in prev_squares and sq[1] != player_id])
+    opponent_new_squares = (new_squares & opponent_squares).bit_count()
     
     # Count total squares for both players
-    ai_total_squares = len([sq for sq in current_squares.items() if sq[1] == player_id])
-    opponent_total_squares = len([sq for sq in current_squares.items() if sq[1] != player_id])
+    ai_total_squares = squares_owner.bit_count()
+    opponent_total_squares = opponent_squares.bit_count()
     
     # Base reward for completing squares
     reward = ai_new_squares * 30  # Increased reward for completing squares
@@ -121,281 +351,266 @@ def calculate_reward(prev_squares, current_squares, player_id):
     
     return reward
 
+def snapshot_q_table():
+    """Copy the used part of the Q-table (caller holds q_table_lock)"""
+    rows = len(state_row)
+    return {'state_row': dict(state_row), 'values': Q_values[:rows].copy(), 'seen': Q_seen[:rows].copy()}
+
 # Save Q-table function
-def save_q_table():
-    """Save Q-table to disk"""
+def save_q_table(snapshot):
+    """Save a Q-table snapshot to disk"""
     try:
-        # Convert defaultdict to regular dict for saving
-        q_dict = {k: dict(v) for k, v in Q_table.items()}
-        with open(Q_TABLE_FILE, 'wb') as f:
-            pickle.dump(q_dict, f)
+        # Write to a temporary file first so a crash never leaves a truncated table
+        tmp_file = Q_TABLE_FILE + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, Q_TABLE_FILE)
         logger.info("Q-table saved successfully")
+        return True
     except Exception as e:
         logger.error(f"Error saving Q-table: {e}")
+        return False
 
-def check_for_completed_squares(board, row1, col1, row2, col2):
-    """Check for completed squares after drawing a line"""
-    completed_squares = []
-    
-    # Determine if the line is horizontal or vertical
-    is_horizontal = row1 == row2
-    
-    if is_horizontal:
-        # Check square above
-        if row1 > 0:
-            top = f"{row1-1},{col1}-{row1-1},{col2}"
-            left = f"{row1-1},{min(col1, col2)}-{row1},{min(col1, col2)}"
-            right = f"{row1-1},{max(col1, col2)}-{row1},{max(col1, col2)}"
-            
-            if top in board['lines'] and left in board['lines'] and right in board['lines']:
-                completed_squares.append(f"{row1-1},{min(col1, col2)}")
+def compact_q_table():
+    """Save the full Q-table and drop the WAL records the save covers"""
+    global updates_since_save
+    
+    # Snapshot under the lock, but write the file without blocking updates
+    with q_table_lock:
+        snapshot = snapshot_q_table()
+        wal_file.flush()
+        covered = wal_file.tell()
+        updates_since_save = 0
+    
+    if not save_q_table(snapshot):
+        return
+    
+    # Keep only the records logged while the snapshot was being written
+    with q_table_lock:
+        wal_file.flush()
+        with open(Q_WAL_FILE, 'rb') as f:
+            f.seek(covered)
+            tail = f.read()
+        wal_file.seek(0)
+        wal_file.truncate()
+        wal_file.write(tail)
+
+# Save requests from /api/update; the worker coalesces bursts into one save
+save_queue = queue.Queue()
+
+def save_worker():
+    """Compact the Q-table in the background whenever a save is requested"""
+    last_save = float('-inf')
+    while True:
+        save_queue.get()
         
-        # Check square below
-        if row1 < 4:
-            bottom = f"{row1+1},{col1}-{row1+1},{col2}"
-            left = f"{row1},{min(col1, col2)}-{row1+1},{min(col1, col2)}"
-            right = f"{row1},{max(col1, col2)}-{row1+1},{max(col1, col2)}"
-            
-            if bottom in board['lines'] and left in board['lines'] and right in board['lines']:
-                completed_squares.append(f"{row1},{min(col1, col2)}")
-    else:
-        # Check square to the left
-        if col1 > 0:
-            left = f"{row1},{col1-1}-{row2},{col1-1}"
-            top = f"{min(row1, row2)},{col1-1}-{min(row1, row2)},{col1}"
-            bottom = f"{max(row1, row2)},{col1-1}-{max(row1, row2)},{col1}"
-            
-            if left in board['lines'] and top in board['lines'] and bottom in board['lines']:
-                completed_squares.append(f"{min(row1, row2)},{col1-1}")
+        # Rate-limit saves, then drop requests that arrived in the meantime
+        time.sleep(max(0.0, last_save + SAVE_MIN_INTERVAL - time.monotonic()))
+        while True:
+            try:
+                save_queue.get_nowait()
+            except queue.Empty:
+                break
         
-        # Check square to the right
-        if col1 < 4:
-            right = f"{row1},{col1+1}-{row2},{col1+1}"
-            top = f"{min(row1, row2)},{col1}-{min(row1, row2)},{col1+1}"
-            bottom = f"{max(row1, row2)},{col1}-{max(row1, row2)},{col1+1}"
-            
-            if right in board['lines'] and top in board['lines'] and bottom in board['lines']:
-                completed_squares.append(f"{min(row1, row2)},{col1}")
-    
-    return completed_squares
+        compact_q_table()
+        last_save = time.monotonic()
 
-def move_completes_square(board, line_key):
-    """Check if drawing this line would complete a square"""
-    # Parse the line key
-    parts = line_key.split('-')
-    start = parts[0].split(',')
-    end = parts[1].split(',')
-    
-    row1, col1 = int(start[0]), int(start[1])
-    row2, col2 = int(end[0]), int(end[1])
-    
-    # Create a copy of the board with this line added
-    board_copy = {'lines': board['lines'].copy(), 'squares': board['squares'].copy()}
-    board_copy['lines'][line_key] = True
-    
-    # Check if squares are completed
-    completed_squares = check_for_completed_squares(board_copy, row1, col1, row2, col2)
+def flush_wal():
+    """Flush and fsync the WAL, then schedule the next flush"""
+    try:
+        # Only the buffer flush needs the lock; the slow disk sync runs without it
+        with q_table_lock:
+            wal_file.flush()
+        os.fsync(wal_file.fileno())
+    except Exception as e:
+        logger.error(f"Error flushing Q-table WAL: {e}")
     
-    return len(completed_squares) > 0
+    timer = threading.Timer(WAL_FLUSH_INTERVAL, flush_wal)
+    timer.daemon = True
+    timer.start()
 
-def count_sides_in_box(board, row, col):
+flush_wal()
+threading.Thread(target=save_worker, daemon=True).start()
+
+def count_sides_in_box(lines_bits, row, col):
     """Count how many sides of a box are already drawn"""
-    if row < 0 or row >= 4 or col < 0 or col >= 4:
+    side_bits = BOX_SIDE_BITS.get((row, col))
+    if side_bits is None:
         return 0  # Invalid box position
-        
-    top = f"{row},{col}-{row},{col+1}" in board['lines']
-    right = f"{row},{col+1}-{row+1},{col+1}" in board['lines']
-    bottom = f"{row+1},{col}-{row+1},{col+1}" in board['lines']
-    left = f"{row},{col}-{row+1},{col}" in board['lines']
     
-    return sum([top, right, bottom, left])
+    return (lines_bits & side_bits).bit_count()
 
-def would_give_away_square(board, line_key):
-    """Check if adding this line would set up a square for the opponent to complete"""
-    # Parse the line key
-    parts = line_key.split('-')
-    start = parts[0].split(',')
-    end = parts[1].split(',')
-    
-    row1, col1 = int(start[0]), int(start[1])
-    row2, col2 = int(end[0]), int(end[1])
-    
-    # Create a copy of the board with this line added
-    board_copy = {'lines': board['lines'].copy(), 'squares': board['squares'].copy()}
-    board_copy['lines'][line_key] = True
-    
-    # Check if this creates any boxes with 3 sides
-    # Horizontal line
-    if row1 == row2:
-        # Check box above (if it exists)
-        if row1 > 0 and count_sides_in_box(board_copy, row1-1, min(col1, col2)) == 3:
-            return True
-            
-        # Check box below (if it exists)
-        if row1 < 4 and count_sides_in_box(board_copy, row1, min(col1, col2)) == 3:
-            return True
-    
-    # Vertical line
-    else:
-        # Check box to the left (if it exists)
-        if col1 > 0 and count_sides_in_box(board_copy, min(row1, row2), col1-1) == 3:
-            return True
-            
-        # Check box to the right (if it exists)
-        if col1 < 4 and count_sides_in_box(board_copy, min(row1, row2), col1) == 3:
-            return True
-    
-    return False
+def box_side_counts(lines_bits):
+    """Side counts of all 16 boxes, packed into the nibbles of one int"""
+    box_counts = 0
+    for (row, col), shift in BOX_SHIFT.items():
+        box_counts |= count_sides_in_box(lines_bits, row, col) << shift
+    return box_counts
 
-def find_moves_by_priority(board):
+def box_count(box_counts, box):
+    """Read one box's side count from the packed counts"""
+    return (box_counts >> BOX_SHIFT[box]) & 0xF
+
+def find_moves_by_priority(lines_bits, state):
     """Find and classify moves by priority:
     1. Moves that complete squares (highest priority)
     2. Strategic moves that set up chains of boxes
     3. Moves that don't give away squares (medium priority)
     4. All other moves (lowest priority)
-    """
-    grid_size = 5
-    all_moves = []
-    
-    # Get all available moves
-    for row in range(grid_size):
-        for col in range(grid_size - 1):
-            line_key = f"{row},{col}-{row},{col+1}"
-            if line_key not in board['lines']:
-                all_moves.append(line_key)
-    
-    for row in range(grid_size - 1):
-        for col in range(grid_size):
-            line_key = f"{row},{col}-{row+1},{col}"
-            if line_key not in board['lines']:
-                all_moves.append(line_key)
-    
-    # Classify moves
-    completing_moves = []
-    strategic_moves = []
-    safe_moves = []
-    unsafe_moves = []
-    
-    for move in all_moves:
-        if move_completes_square(board, move):
-            completing_moves.append(move)
-        elif would_give_away_square(board, move):
-            # Still classify by how many boxes it would give away
-            unsafe_moves.append(move)
-        else:
-            # Check if this move is strategic (could lead to chains)
-            if is_strategic_move(board, move):
-                strategic_moves.append(move)
-            else:
-                safe_moves.append(move)
-    
-    return {
-        'completing': completing_moves,
-        'strategic': strategic_moves,
-        'safe': safe_moves,
-        'unsafe': unsafe_moves,
-        'all': all_moves
-    }
-
-def is_strategic_move(board, line_key):
-    """Check if a move is strategic - sets up potential chains of boxes"""
-    # Parse the line key
-    parts = line_key.split('-')
-    start = parts[0].split(',')
-    end = parts[1].split(',')
-    
-    row1, col1 = int(start[0]), int(start[1])
-    row2, col2 = int(end[0]), int(end[1])
     
-    # Create a copy of the board with this line added
-    board_copy = {'lines': board['lines'].copy(), 'squares': board['squares'].copy()}
-    board_copy['lines'][line_key] = True
+    Each move is returned as a (move_bit, q_value) tuple for the given state.
+    """
+    completing, strategic, safe, unsafe = classify_moves(lines_bits)
     
-    # Check for boxes with exactly 2 sides (developing boxes)
-    developing_boxes = []
+    # Read the state's whole Q-row at once; unseen states read as all zeros
+    with q_table_lock:
+        row = find_state_row(state)
+        q_row = Q_values[row].tolist() if row is not None else [0.0] * Q_ACTIONS
     
-    # Horizontal line
-    if row1 == row2:
-        # Check boxes related to this line
-        if row1 > 0 and count_sides_in_box(board_copy, row1-1, min(col1, col2)) == 2:
-            developing_boxes.append((row1-1, min(col1, col2)))
-            
-        if row1 < 4 and count_sides_in_box(board_copy, row1, min(col1, col2)) == 2:
-            developing_boxes.append((row1, min(col1, col2)))
-    # Vertical line
-    else:
-        # Check boxes related to this line
-        if col1 > 0 and count_sides_in_box(board_copy, min(row1, row2), col1-1) == 2:
-            developing_boxes.append((min(row1, row2), col1-1))
-            
-        if col1 < 4 and count_sides_in_box(board_copy, min(row1, row2), col1) == 2:
-            developing_boxes.append((min(row1, row2), col1))
-    
-    # If we have at least one developing box, check adjacent boxes
-    # to see if we're potentially setting up a chain
-    if developing_boxes:
-        for box_row, box_col in developing_boxes:
-            # Check all adjacent boxes
-            adjacent_boxes = [
-                (box_row-1, box_col),  # above
-                (box_row+1, box_col),  # below
-                (box_row, box_col-1),  # left
-                (box_row, box_col+1)   # right
-            ]
-            
-            for adj_row, adj_col in adjacent_boxes:
-                # Skip invalid boxes
-                if adj_row < 0 or adj_row >= 4 or adj_col < 0 or adj_col >= 4:
-                    continue
-                
-                # If an adjacent box has 1 side, this could be part of a chain strategy
-                if count_sides_in_box(board_copy, adj_row, adj_col) == 1:
-                    return True
-        
-        # Even without adjacent boxes with 1 side, having multiple developing boxes
-        # is generally strategic
-        return len(developing_boxes) > 1
+    moves_by_priority = {'completing': [], 'strategic': [], 'safe': [], 'unsafe': [], 'all': []}
+    for move_bit, move in enumerate(LINE_MASKS):
+        if lines_bits & move:
+            continue
         
-    return False
+        # Look up the Q-value once while bucketing the move
+        entry = (move_bit, q_row[move_bit])
+        if completing & move:
+            moves_by_priority['completing'].append(entry)
+        elif strategic & move:
+            moves_by_priority['strategic'].append(entry)
+        elif safe & move:
+            moves_by_priority['safe'].append(entry)
+        else:
+            moves_by_priority['unsafe'].append(entry)
+        moves_by_priority['all'].append(entry)
+    
+    return moves_by_priority
 
-def evaluate_risk(board, move):
+def evaluate_risk(box_counts, move_bit):
     """Evaluate how risky a move is based on how many potential squares it gives away"""
-    # Parse the line key
-    parts = move.split('-')
-    start = parts[0].split(',')
-    end = parts[1].split(',')
-    
-    row1, col1 = int(start[0]), int(start[1])
-    row2, col2 = int(end[0]), int(end[1])
-    
-    # Create a copy of the board with this line added
-    board_copy = {'lines': board['lines'].copy(), 'squares': board['squares'].copy()}
-    board_copy['lines'][move] = True
+    box_counts += LINE_COUNT_STEP[move_bit]
     
     # Count how many boxes would be at 3 sides
-    boxes_at_risk = 0
+    return sum(1 for box in LINES_TO_BOXES[move_bit] if box_count(box_counts, box) == 3)
+
+# Lookup tables for the compiled classifier: for each line bit, the side masks of
+# the (up to two) boxes it borders, and of each of those boxes' neighbours.
+# Missing boxes are padded with a 0 mask, which never counts as 1-4 sides.
+LINE_BOX_MASKS = np.zeros((len(LINE_BIT), 2), dtype=np.int64)
+LINE_NEIGHBOUR_MASKS = np.zeros((len(LINE_BIT), 2, 4), dtype=np.int64)
+for move_bit, boxes in enumerate(LINES_TO_BOXES):
+    for i, box in enumerate(boxes):
+        LINE_BOX_MASKS[move_bit, i] = BOX_SIDE_BITS[box]
+        for j, neighbour in enumerate(BOX_NEIGHBOURS[box]):
+            LINE_NEIGHBOUR_MASKS[move_bit, i, j] = BOX_SIDE_BITS[neighbour]
+
+def _popcount(x):
+    """Count set bits (int.bit_count is not available under numba)"""
+    count = 0
+    while x:
+        x &= x - 1
+        count += 1
+    return count
+
+def _classify_moves_kernel(lines_bits, line_box_masks, neighbour_masks):
+    """Classify every free line in one pass, returning (completing, strategic,
+    safe, unsafe) bitmasks. After drawing the line:
+    - completing: a box it borders has all 4 sides
+    - unsafe: a box it borders has 3 sides (the opponent can take it)
+    - strategic: a box it borders has 2 sides next to a box with 1 side,
+      or both boxes it borders have 2 sides (sets up chains)
+    - safe: anything else"""
+    completing = strategic = safe = unsafe = 0
+    
+    for move_bit in range(line_box_masks.shape[0]):
+        move = 1 << move_bit
+        if lines_bits & move:
+            continue
+        after = lines_bits | move
+        
+        completes = gives_away = chain = False
+        developing = 0
+        for i in range(2):
+            count = _popcount(after & line_box_masks[move_bit, i])
+            if count == 4:
+                completes = True
+            elif count == 3:
+                gives_away = True
+            elif count == 2:
+                developing += 1
+                for j in range(4):
+                    if _popcount(after & neighbour_masks[move_bit, i, j]) == 1:
+                        chain = True
+        
+        if completes:
+            completing |= move
+        elif gives_away:
+            unsafe |= move
+        elif chain or developing > 1:
+            strategic |= move
+        else:
+            safe |= move
     
-    # Horizontal line
-    if row1 == row2:
-        # Check box above (if it exists)
-        if row1 > 0 and count_sides_in_box(board_copy, row1-1, min(col1, col2)) == 3:
-            boxes_at_risk += 1
-            
-        # Check box below (if it exists)
-        if row1 < 4 and count_sides_in_box(board_copy, row1, min(col1, col2)) == 3:
-            boxes_at_risk += 1
-    
-    # Vertical line
-    else:
-        # Check box to the left (if it exists)
-        if col1 > 0 and count_sides_in_box(board_copy, min(row1, row2), col1-1) == 3:
-            boxes_at_risk += 1
-            
-        # Check box to the right (if it exists)
-        if col1 < 4 and count_sides_in_box(board_copy, min(row1, row2), col1) == 3:
-            boxes_at_risk += 1
+    return completing, strategic, safe, unsafe
+
+if njit is not None:
+    _popcount = njit(cache=True)(_popcount)
+    _classify_moves_kernel = njit(cache=True)(_classify_moves_kernel)
+
+def generate_classifier_source():
+    """Generate straight-line Python that classifies every line of the fixed 5x5
+    board, with each line's box and neighbour masks inlined as literals.
+    Mirrors _classify_moves_kernel."""
+    source = ['def _classify_moves_generated(lines_bits):',
+              '    completing = strategic = safe = unsafe = 0']
+    
+    for move_bit, boxes in enumerate(LINES_TO_BOXES):
+        move = LINE_MASKS[move_bit]
+        counts = [f"c{i}" for i in range(len(boxes))]
+        
+        # Chain test: a developing (2-sided) box next to a box with 1 side,
+        # or two developing boxes at once
+        strategic_terms = []
+        for count, box in zip(counts, boxes):
+            chain = ' or '.join(f"(after & {BOX_SIDE_BITS[neighbour]:#x}).bit_count() == 1"
+                                for neighbour in BOX_NEIGHBOURS[box])
+            strategic_terms.append(f"({count} == 2 and ({chain}))")
+        if len(boxes) == 2:
+            strategic_terms.append("(c0 == 2 and c1 == 2)")
+        
+        source.append(f"    if not lines_bits & {move:#x}:")
+        source.append(f"        after = lines_bits | {move:#x}")
+        for count, box in zip(counts, boxes):
+            source.append(f"        {count} = (after & {BOX_SIDE_BITS[box]:#x}).bit_count()")
+        source.append(f"        if {' or '.join(f'{count} == 4' for count in counts)}:")
+        source.append(f"            completing |= {move:#x}")
+        source.append(f"        elif {' or '.join(f'{count} == 3' for count in counts)}:")
+        source.append(f"            unsafe |= {move:#x}")
+        source.append(f"        elif {' or '.join(strategic_terms)}:")
+        source.append(f"            strategic |= {move:#x}")
+        source.append(f"        else:")
+        source.append(f"            safe |= {move:#x}")
+    
+    source.append('    return completing, strategic, safe, unsafe')
+    return '\n'.join(source) + '\n'
+
+# Without numba, compile the specialized classifier once at startup
+if njit is None:
+    _generated_namespace = {}
+    exec(compile(generate_classifier_source(), '<generated classifier>', 'exec'), _generated_namespace)
+    _classify_moves_generated = _generated_namespace['_classify_moves_generated']
+
+def classify_moves(lines_bits):
+    """Classify all free lines into (completing, strategic, safe, unsafe) bitmasks"""
+    if njit is not None:
+        return _classify_moves_kernel(lines_bits, LINE_BOX_MASKS, LINE_NEIGHBOUR_MASKS)
     
-    return boxes_at_risk
+    # Without numba, use the generated straight-line classifier
+    return _classify_moves_generated(lines_bits)
+
+# Trigger the numba compile (or load it from the cache) at startup rather than on the first /api/move
+if njit is not None:
+    classify_moves(0)
 
 # API endpoint for AI moves
 @app.route('/api/move', methods=['POST'])
@@ -407,19 +622,24 @@ def get_ai_move():
         data = request.get_json()
         board = data['board']
         player_id = data.get('player_id', 'ai-player')
+        session_id = data.get('session_id', player_id)
+        
+        # Decode the board into bitmasks once per request
+        lines_bits = lines_to_bits(board['lines'])
+        squares_bits, squares_owner = squares_to_bits(board['squares'], player_id)
         
         # Get the current state
-        current_state = board_to_state(board)
+        current_state = board_to_state(lines_bits, squares_bits, squares_owner)
         
         # Get moves classified by priority
-        moves_by_priority = find_moves_by_priority(board)
+        moves_by_priority = find_moves_by_priority(lines_bits, current_state)
         
         # No available moves
         if not moves_by_priority['all']:
             return jsonify({'move': None})
         
         # Count total completed squares to determine game phase
-        total_squares = len(board['squares'])
+        total_squares = squares_bits.bit_count()
         game_progress = total_squares / 16.0  # 0.0 to 1.0 indicating progress
         
         # Determine what kind of move to make based on priorities
@@ -430,57 +650,55 @@ def get_ai_move():
             # Exploration: still prioritize good moves but with randomness
             if moves_by_priority['completing'] and random.random() < 0.95:
                 # 95% chance to pick a completing move if available during exploration
-                chosen_action = random.choice(moves_by_priority['completing'])
-                logger.info(f"Exploring but chose a completing move: {chosen_action}")
+                chosen_action = random.choice(moves_by_priority['completing'])[0]
+                logger.info(f"Exploring but chose a completing move: {ALL_LINE_KEYS[chosen_action]}")
             elif moves_by_priority['strategic'] and random.random() < 0.8:
                 # 80% chance to pick a strategic move if available during exploration
-                chosen_action = random.choice(moves_by_priority['strategic'])
-                logger.info(f"Exploring with a strategic move: {chosen_action}")
+                chosen_action = random.choice(moves_by_priority['strategic'])[0]
+                logger.info(f"Exploring with a strategic move: {ALL_LINE_KEYS[chosen_action]}")
             elif moves_by_priority['safe'] and random.random() < 0.7:
                 # 70% chance to pick a safe move if available during exploration
-                chosen_action = random.choice(moves_by_priority['safe'])
-                logger.info(f"Exploring with a safe move: {chosen_action}")
+                chosen_action = random.choice(moves_by_priority['safe'])[0]
+                logger.info(f"Exploring with a safe move: {ALL_LINE_KEYS[chosen_action]}")
             else:
                 # Otherwise pick any move
-                chosen_action = random.choice(moves_by_priority['all'])
-                logger.info(f"Pure exploration with any move: {chosen_action}")
+                chosen_action = random.choice(moves_by_priority['all'])[0]
+                logger.info(f"Pure exploration with any move: {ALL_LINE_KEYS[chosen_action]}")
         else:
             # Exploitation: make the best move based on priorities and Q-values
             if moves_by_priority['completing']:
                 # If there are moves that complete squares, pick the one with highest Q-value
-                chosen_action = max(moves_by_priority['completing'], 
-                                  key=lambda move: Q_table[current_state][move])
-                logger.info(f"Chose a completing move: {chosen_action}")
+                chosen_action = max(moves_by_priority['completing'], key=itemgetter(1))[0]
+                logger.info(f"Chose a completing move: {ALL_LINE_KEYS[chosen_action]}")
             elif moves_by_priority['strategic'] and game_progress < 0.6:
                 # Early to mid game: prioritize strategic moves
-                chosen_action = max(moves_by_priority['strategic'], 
-                                  key=lambda move: Q_table[current_state][move])
-                logger.info(f"Chose a strategic move: {chosen_action}")
+                chosen_action = max(moves_by_priority['strategic'], key=itemgetter(1))[0]
+                logger.info(f"Chose a strategic move: {ALL_LINE_KEYS[chosen_action]}")
             elif moves_by_priority['safe']:
                 # If there are safe moves, pick the one with highest Q-value
-                chosen_action = max(moves_by_priority['safe'], 
-                                  key=lambda move: Q_table[current_state][move])
-                logger.info(f"Chose a safe move: {chosen_action}")
+                chosen_action = max(moves_by_priority['safe'], key=itemgetter(1))[0]
+                logger.info(f"Chose a safe move: {ALL_LINE_KEYS[chosen_action]}")
             elif moves_by_priority['unsafe']:
                 # Late game or only unsafe moves remain
-                # Sort unsafe moves by risk (fewer boxes at risk is better)
-                sorted_unsafe = sorted(moves_by_priority['unsafe'], 
-                                       key=lambda move: evaluate_risk(board, move))
-                
-                # Choose the least risky move
-                chosen_action = sorted_unsafe[0] if sorted_unsafe else moves_by_priority['all'][0]
-                logger.info(f"Had to choose an unsafe move: {chosen_action} with risk level: {evaluate_risk(board, chosen_action)}")
+                box_counts = box_side_counts(lines_bits)
+                # Choose the least risky move (fewer boxes at risk is better)
+                chosen_action = min(moves_by_priority['unsafe'], 
+                                    key=lambda entry: evaluate_risk(box_counts, entry[0]))[0]
+                logger.info(f"Had to choose an unsafe move: {ALL_LINE_KEYS[chosen_action]} with risk level: {evaluate_risk(box_counts, chosen_action)}")
         
         # Convert chosen action to line coordinates
-        line = get_line_from_key(chosen_action)
+        line = get_line_from_key(ALL_LINE_KEYS[chosen_action])
         
         # Decay exploration rate
         exploration_rate = max(MIN_EXPLORATION_RATE, 
                              exploration_rate * EXPLORATION_DECAY)
         
         # Save the current state and action for updating Q-values later
-        with open('current_state.txt', 'w') as f:
-            f.write(f"{current_state}|{chosen_action}")
+        with session_lock:
+            last_state_action[session_id] = (current_state, chosen_action, squares_bits)
+            last_state_action.move_to_end(session_id)
+            if len(last_state_action) > MAX_PENDING_SESSIONS:
+                last_state_action.popitem(last=False)
         
         return jsonify({'move': line})
     
@@ -491,6 +709,8 @@ def get_ai_move():
 # API endpoint to update Q-values after move
 @app.route('/api/update', methods=['POST'])
 def update_q_values():
+    global updates_since_save
+    
     try:
         # Get data from request
         data = request.get_json()
@@ -498,51 +718,53 @@ def update_q_values():
         reward = data.get('reward', 0)
         completed_squares = data.get('completed_squares', [])
         player_id = data.get('player_id', 'ai-player')
+        session_id = data.get('session_id', player_id)
         
-        # Try to read previous state and action
-        try:
-            with open('current_state.txt', 'r') as f:
-                state_action = f.read().split('|')
-                prev_state = state_action[0]
-                action = state_action[1]
-        except:
+        # Look up the previous state and action for this session
+        with session_lock:
+            state_action = last_state_action.pop(session_id, None)
+        if state_action is None:
             logger.warning("No previous state found")
             return jsonify({'status': 'no previous state'})
+        prev_state, action, prev_squares_bits = state_action
         
         # Convert new board to new state
-        new_state = board_to_state(new_board)
+        new_lines_bits = lines_to_bits(new_board['lines'])
+        new_squares_bits, new_squares_owner = squares_to_bits(new_board['squares'], player_id)
+        new_state = board_to_state(new_lines_bits, new_squares_bits, new_squares_owner)
         
         # Calculate reward if not provided
         if reward == 0 and completed_squares:
-            # Extract previous squares from prev_state
-            prev_squares = {}
-            if '|squares:' in prev_state:
-                squares_part = prev_state.split('|squares:')[1]
-                if squares_part:
-                    for square_info in squares_part.split(','):
-                        if ':' in square_info:
-                            pos, owner = square_info.split(':')
-                            prev_squares[pos] = owner
-            
-            reward = calculate_reward(prev_squares, new_board['squares'], player_id)
+            reward = calculate_reward(prev_squares_bits, new_squares_bits, new_squares_owner)
         
         logger.info(f"Reward for move: {reward}")
         
-        # Get current Q-value
-        current_q = Q_table[prev_state][action]
-        
-        # Find maximum Q-value for the new state
-        max_future_q = max([Q_table[new_state][a] for a in Q_table[new_state]], default=0)
-        
-        # Update Q-value using Q-learning formula
-        new_q = current_q + LEARNING_RATE * (reward + DISCOUNT_FACTOR * max_future_q - current_q)
-        
-        # Update Q-table
-        Q_table[prev_state][action] = new_q
-        
-        # Save Q-table periodically (e.g., every 10 updates)
-        if random.random() < 0.1:  # 10% chance to save
-            save_q_table()
+        with q_table_lock:
+            # Get current Q-value
+            row = get_state_row(prev_state)
+            current_q = float(Q_values[row, action])
+            
+            # Find maximum Q-value for the new state, over the actions written so far.
+            # A masked reduction avoids copying the row; reads never allocate a row.
+            max_future_q = 0.0
+            new_row = find_state_row(new_state)
+            if new_row is not None:
+                best_q = Q_values[new_row].max(initial=-np.inf, where=Q_seen[new_row])
+                if best_q != -np.inf:
+                    max_future_q = float(best_q)
+            
+            # Update Q-value using Q-learning formula
+            new_q = current_q + LEARNING_RATE * (reward + DISCOUNT_FACTOR * max_future_q - current_q)
+            
+            # Update Q-table and log the update; the WAL is flushed in the background
+            Q_values[row, action] = new_q
+            Q_seen[row, action] = True
+            wal_file.write(WAL_RECORD.pack(prev_state, action, new_q))
+            
+            # Ask the background saver to fold the WAL into a full save
+            updates_since_save += 1
+            if updates_since_save >= WAL_COMPACT_EVERY:
+                save_queue.put_nowait(True)
         
         return jsonify({'status': 'updated', 'new_q': new_q})
     
@@ -555,7 +777,7 @@ def update_q_values():
 def get_info():
     return jsonify({
         'exploration_rate': exploration_rate,
-        'q_table_size': len(Q_table),
+        'q_table_size': len(state_row),
         'learning_rate': LEARNING_RATE,
         'discount_factor': DISCOUNT_FACTOR
     })
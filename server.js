@@ -221,7 +221,8 @@ function makeAIMove(roomCode) {
             // Step 1: Ask AI server for the best move
             const aiResponse = await axios.post('http://localhost:5000/api/move', {
                 board: room.board,
-                player_id: 'ai-player'
+                player_id: 'ai-player',
+                session_id: roomCode
             });
             
             const aiLine = aiResponse.data.move;
@@ -271,7 +272,8 @@ function makeAIMove(roomCode) {
             await axios.post('http://localhost:5000/api/update', {
                 board: room.board,
                 completed_squares: completedSquares,
-                player_id: 'ai-player'
+                player_id: 'ai-player',
+                session_id: roomCode
             });
             
             // Check if game is over